@@ -0,0 +1,75 @@
+"""
+class AsyncRWLock is an asyncio reader-writer lock
+
+Detector reads (status and config readbacks) may run side by side, while commands and configuration
+(writers) get exclusive access to the detector. Waiting writers block new readers, so a stream of
+periodic reads cannot hold off an arm or disarm.
+"""
+
+import asyncio
+
+
+class _LockSide:
+    """ async context manager for one side (reader or writer) of an AsyncRWLock """
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    async def __aenter__(self):
+        await self._acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._release()
+
+
+class AsyncRWLock:
+    """
+    Any number of readers, or a single writer. Use as `async with lock.reader:` or `async with lock.writer:`.
+    Not reentrant: a holder must not acquire either side again.
+    Releasing never awaits, so a cancelled holder always gives the lock back.
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._waiters = []
+        self.reader = _LockSide(self._acquire_read, self._release_read)
+        self.writer = _LockSide(self._acquire_write, self._release_write)
+
+    def _wake(self):
+        """ lets every waiter re-check whether it can go ahead """
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def _wait_until(self, predicate):
+        while not predicate():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    async def _acquire_read(self):
+        await self._wait_until(lambda: not self._writer and self._writers_waiting == 0)
+        self._readers += 1
+
+    def _release_read(self):
+        self._readers -= 1
+        if self._readers == 0:
+            self._wake()
+
+    async def _acquire_write(self):
+        self._writers_waiting += 1
+        try:
+            await self._wait_until(lambda: not self._writer and self._readers == 0)
+        finally:
+            self._writers_waiting -= 1
+            # readers held back by this writer re-check (and wait again if it got the lock)
+            self._wake()
+        self._writer = True
+
+    def _release_write(self):
+        self._writer = False
+        self._wake()
@@ -2,24 +2,27 @@
 import logging
 from pathlib import Path
 import sys
-import attrs
-from datetime import datetime, timezone
+import math
+from caproto import ChannelType
 from caproto.server import PVGroup, pvproperty, template_arg_parser, run
-import numpy as np
-from deigerclient import DEigerClient
+from requests import RequestException
+from pooled_deigerclient import PooledDEigerClient
 import os 
 import asyncio
+import contextlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from validators import validate_ip_address, validate_port_number, ensure_directory_exists_and_is_writeable
 from custom_operations import CustomPostExposureOperation
+from async_rwlock import AsyncRWLock
 import time
 from typing import Callable
 
-import logging
-
 logger = logging.getLogger("DEigerIOC")
+# messages are dropped unless the application configures logging
+logger.addHandler(logging.NullHandler())
 # logger.setLevel(logging.INFO)
 
-@attrs.define
 class DEigerIOC(PVGroup):
     """
     A caproto-based IOC (Input/Output Controller) for managing Dectris Eiger detectors.
@@ -33,46 +36,102 @@ class DEigerIOC(PVGroup):
     Attributes:
         host (str): IP address of the detector.
         port (int): Port number for the detector connection.
-        client (DEigerClient): Client interface for communicating with the detector.
+        client (PooledDEigerClient): Client interface for communicating with the detector.
         LocalFileDumpPath (Path): Path where the detector files are stored locally.
         _nframes (int): Number of frames to be taken in a single exposure.
-        _starttime (datetime): Start time of the exposure.
+        _starttime_monotonic (float): Start time of the exposure on the monotonic clock, for elapsed-time arithmetic.
         
     authors: Brian R. Pauw, Anja Hörmann. 
     DEigerClient from Dectris
     License: MIT    
     """
 
-    host: str = attrs.field(default="172.17.1.2", validator=validate_ip_address, converter=str)
-    port: int = attrs.field(default=80, validator=validate_port_number, converter=int)
-    client: DEigerClient = attrs.field(init=False, validator=attrs.validators.optional(attrs.validators.instance_of(DEigerClient)))
+    host: str
+    port: int
+    client: PooledDEigerClient
     # files measured on the detector are stored here. 
-    LocalFileDumpPath: Path = attrs.field(default=Path("/tmp"), converter=Path, validator=[attrs.validators.instance_of(Path), ensure_directory_exists_and_is_writeable])
+    LocalFileDumpPath: Path
     # number of frames to be taken in a single exposure
-    _nframes: int = attrs.field(default=1, validator=attrs.validators.optional(attrs.validators.instance_of(int)))
-    _nimages_per_file:int = attrs.field(default=1800, validator=attrs.validators.instance_of(int))
-    # start time of the exposure
-    _starttime: datetime = attrs.field(default=None, validator=attrs.validators.optional(attrs.validators.instance_of(datetime)))
+    _nframes: int
+    _nimages_per_file: int
+    # start time of the exposure, on the monotonic clock
+    _starttime_monotonic: float | None
     # for any location-specific operations that need to be performed after data collection
-    custom_post_exposure_operation: CustomPostExposureOperation = attrs.field(factory=CustomPostExposureOperation)
+    custom_post_exposure_operation: CustomPostExposureOperation
     # if we tried writing while the detector was initializing or measuring:
-    _detector_initialized:bool = attrs.field(default=False, validator=attrs.validators.instance_of(bool))
-    _detector_configured:bool = attrs.field(default=False, validator=attrs.validators.instance_of(bool))
-    _communications_lock: asyncio.Lock = attrs.field(factory=asyncio.Lock)
-
-    def __init__(self, *args, **kwargs) -> None:
-        for k in list(kwargs.keys()):
-            if k in ['host', 'port']:
-                setattr(self, k, kwargs.pop(k))
-        self.LocalFileDumpPath = kwargs.pop('localPath', Path("/tmp"))
-        print(f'{self.LocalFileDumpPath=}')
-        self.client = DEigerClient(self.host, port=self.port)
-        self._starttime = None #datetime.now(timezone.utc)
+    _detector_initialized: bool
+    _detector_configured: bool
+    # shared by detector reads, exclusive for detector commands and configuration
+    _communications_lock: AsyncRWLock
+    # cleared while the Initialize putter is running, so waiters don't have to poll Initialize_RBV
+    _init_done: asyncio.Event
+    # same for the Configure putter
+    _configure_done: asyncio.Event
+    # detector and filewriter config values waiting to be written by flush_config, per write group
+    _pending_config: dict
+    # worker threads for blocking detector commands and concurrent file downloads, keeps the event loop free
+    _executor: ThreadPoolExecutor
+    # plain copies of PV values used on hot paths, kept up to date by the PV putters
+    _output_prefix: str
+    _count_time: float
+    _frame_time: float
+    # recent detector reads as {(readMethod, key): (monotonic time, value)}, valid for _read_cache_ttl seconds
+    _read_cache: dict
+    _read_cache_ttl: float
+    # detector config values only change when the IOC configures the detector (which invalidates them), so they are cached longer
+    _config_cache_ttl: float
+    # one lock per config key, so simultaneous readbacks of the same key share a single detector read
+    _config_read_locks: defaultdict
+    # number of detector reads that failed in a row, used to back off the status polling while the detector is unreachable
+    _consecutive_read_failures: int
+    # set on detector state changes made by the IOC (initialize, configure, restart, arm, disarm) to refresh the status readouts right away
+    _status_wakeup: asyncio.Event
+    # True from the start of a Trigger until its files are retrieved
+    _capture_in_progress: bool
+
+    def __init__(self, *args, host: str = "172.17.1.2", port: int = 80, localPath: Path = Path("/tmp"), 
+                 custom_post_exposure_operation: CustomPostExposureOperation | None = None, **kwargs) -> None:
+        # validated once here, the attributes below are plain instance attributes
+        self.host = str(host)
+        validate_ip_address(self, "host", self.host)
+        self.port = int(port)
+        validate_port_number(self, "port", self.port)
+        self.LocalFileDumpPath = Path(localPath)
+        ensure_directory_exists_and_is_writeable(self, "LocalFileDumpPath", self.LocalFileDumpPath)
+        logger.info("storing detector files in %s", self.LocalFileDumpPath)
+        if custom_post_exposure_operation is None:
+            custom_post_exposure_operation = CustomPostExposureOperation()
+        self.custom_post_exposure_operation = custom_post_exposure_operation
+        # one pooled keep-alive session for all REST calls and file downloads
+        self.client = PooledDEigerClient(self.host, port=self.port)
+        # no exposure started yet, SecondsRemaining reports -999 until the first trigger
+        self._starttime_monotonic = None
         self._nimages_per_file = 1800
         self._detector_initialized = False
-        self._communications_lock = asyncio.Lock()
+        self._detector_configured = False
+        self._communications_lock = AsyncRWLock()
+        self._init_done = asyncio.Event()
+        self._init_done.set()
+        self._configure_done = asyncio.Event()
+        self._configure_done.set()
         self._nframes = 0
+        self._pending_config = {}
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='deiger-io')
+        self._read_cache = {}
+        self._read_cache_ttl = 0.5
+        self._config_cache_ttl = 30.0
+        self._config_read_locks = defaultdict(asyncio.Lock)
+        self._consecutive_read_failures = 0
+        self._status_wakeup = asyncio.Event()
+        self._capture_in_progress = False
         super().__init__(*args, **kwargs)
+        self._output_prefix = self.OutputFilePrefix.value
+        self._count_time = self.CountTime.value
+        self._frame_time = self.FrameTime.value
+
+    async def run_blocking(self, func: Callable, *args):
+        """ runs a blocking (detector I/O) call on the IOC executor and awaits its result, keeping the event loop free"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
 
     def empty_data_store(self):
         self.client.sendFileWriterCommand("clear")
@@ -80,71 +139,101 @@ class DEigerIOC(PVGroup):
         self.client.setFileWriterConfig("mode", "enabled")
 
     def restart_detector(self):
-        print("  restarting detector")        
+        logger.info("restarting detector")
         self.client.sendSystemCommand("restart")
+        self._read_cache.clear()
         time.sleep(.1)
 
-    def initialize_detector(self):
-        print("  sending init command")
+    async def initialize_detector(self):
+        """ sends the initialize command until the detector leaves the 'na'/'error' state. Failed attempts are retried 
+        with exponential backoff (0.25 s, doubling up to 8 s between attempts), giving up after 60 s. 
+        The communications lock is only held for the detector calls, not while waiting between attempts"""
         self._detector_initialized = False
-        Trouble=False
-        try:
-            self.client.sendDetectorCommand("initialize")
-            print("  finished sending init command")
-        except RuntimeError as e:
-            print(f"  Trouble initializing, RunTimeError received: {e}")
-            Trouble=True
-        ntry = 5
-        while (self.DetectorState.value in ['na', 'error']) or Trouble:
-            print(f'failure to initialize detector, trying again {ntry} times out of 5')
-            print(f'{self.DetectorState.value =}, {Trouble =}')
-            time.sleep(1)
+        # initializing may reset the detector configuration, don't serve cached values from before
+        self._read_cache.clear()
+        delay, max_delay = 0.25, 8.0
+        deadline = time.monotonic() + 60
+        state = self.DetectorState.value
+        while True:
+            logger.debug("sending init command")
             try:
-                self.client.sendDetectorCommand("initialize")
-                print("  finished sending init command")
-                Trouble=False
-            except RuntimeError as e:
-                print(f"  Trouble initializing, RunTimeError received: {e}")
-                Trouble=True
-            ntry -=1
-            if ntry <0:
-                print(f'FAILURE TO INITIALIZE detector')
+                async with self._communications_lock.writer:
+                    await self.run_blocking(self.client.sendDetectorCommand, "initialize")
+                    logger.debug("finished sending init command")
+                    # DetectorState is only refreshed periodically, ask the detector directly
+                    state = await self.run_blocking(self.read_detector_configuration_safely, "state", state, 'detectorStatus', 0)
+                if state not in ['na', 'error']:
+                    break
+            except (RequestException, RuntimeError) as e:
+                # RuntimeError is a non-2xx reply, RequestException a transport failure the session did not retry
+                logger.warning("trouble initializing, %s received: %s", type(e).__name__, e)
+            if time.monotonic() + delay > deadline:
+                logger.error("failure to initialize detector")
                 return
+            logger.info("failure to initialize detector (state = %r), trying again in %s s", state, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
                 
         self._detector_initialized = True
         return
 
 
+    def queue_config(self, section: str, key: str, value, group: str | None = None) -> None:
+        """ queues a 'detector' or 'filewriter' configuration value, to be written by flush_config. 
+        Values queued under the same group are written in queue order, a value without a group is written on its own"""
+        self._pending_config.setdefault(group or f"{section}/{key}", {})[(section, key)] = value
+
+    async def flush_config(self) -> None:
+        """ 
+        writes all queued configuration values to the detector over the keep-alive session. 
+        SIMPLON has no multi-key config endpoint, so this is still one PUT per key. Within a group the keys are written 
+        in the order they were queued (the order matters, e.g. photon_energy resets threshold_energy on the detector), 
+        the groups are independent and are written concurrently, one executor job each. 
+        Dispatched from the event loop: an executor job must not block on further jobs in the same bounded pool
+        """
+        pending, self._pending_config = self._pending_config, {}
+        await asyncio.gather(*(self.run_blocking(self._write_config_group, config) for config in pending.values()))
+
+    def _write_config_group(self, config: dict) -> None:
+        setters = {"detector": self.client.setDetectorConfig, "filewriter": self.client.setFileWriterConfig}
+        for (section, key), value in config.items():
+            setters[section](key, value)
+            # don't serve the value from before this write from the read cache
+            if section == "detector":
+                self._read_cache.pop(("detectorConfig", key), None)
+
     def set_energy_values(self, PhotonEnergy = None, ThresholdEnergy = None):
         if PhotonEnergy is None:
             PhotonEnergy = self.PhotonEnergy.value
         if ThresholdEnergy is None:
             ThresholdEnergy = self.ThresholdEnergy.value
-        self.client.setDetectorConfig("photon_energy", PhotonEnergy)
-        self.client.setDetectorConfig("threshold_energy", ThresholdEnergy)
+        # setting photon_energy resets threshold_energy on the detector, so these go in order
+        self.queue_config("detector", "photon_energy", PhotonEnergy, group="energy")
+        self.queue_config("detector", "threshold_energy", ThresholdEnergy, group="energy")
 
     def set_timing_values(self, FrameTime = None, CountTime = None):
         if FrameTime is None:
-            FrameTime = self.FrameTime.value
+            FrameTime = self._frame_time
         if CountTime is None:
-            CountTime = self.CountTime.value
+            CountTime = self._count_time
         """ this also sets _nframes to the correct value"""
-        print("count_time to be set: ", CountTime)
-        self.client.setDetectorConfig("count_time", CountTime)
-        print("frame_time to be set: ", FrameTime)
-        self.client.setDetectorConfig("frame_time", FrameTime) 
+        logger.debug("count_time to be set: %s", CountTime)
+        self.queue_config("detector", "count_time", CountTime, group="timing")
+        logger.debug("frame_time to be set: %s", FrameTime)
+        self.queue_config("detector", "frame_time", FrameTime, group="timing") 
         # maybe something else needs to be added here to account for deadtime between frames. 
-        self._nframes = int(np.ceil(CountTime/ FrameTime))
-        self.client.setDetectorConfig("nimages",self._nframes)
-        self.client.setDetectorConfig("ntrigger", 1) # one trigger per sequence. (trigger_mode = ints)
-        self.client.setDetectorConfig("trigger_mode","ints") # as seen in the dectris example notebook
+        self._nframes = math.ceil(CountTime / FrameTime)
+        self.queue_config("detector", "nimages",self._nframes, group="timing")
+        self.queue_config("detector", "ntrigger", 1, group="timing") # one trigger per sequence. (trigger_mode = ints)
+        self.queue_config("detector", "trigger_mode","ints", group="timing") # as seen in the dectris example notebook
 
     def set_filewriter_config(self):
-        self.client.setFileWriterConfig("mode", "enabled") # write HDF5 files
-        self.client.setFileWriterConfig("name_pattern", f"{self.OutputFilePrefix.value}$id")
-        self.client.setFileWriterConfig("nimages_per_file", self._nimages_per_file) # maximum 1800 frames per file
-        self.client.fileWriterConfig("compression_enabled")
-        self.client.setDetectorConfig("compression", "bslz4")
+        # writing HDF5 files (filewriter mode "enabled") is switched on by empty_data_store, which configure_detector 
+        # always runs just before this
+        self.queue_config("filewriter", "name_pattern", f"{self._output_prefix}$id", group="filewriter")
+        # maximum 1800 frames per file
+        self.queue_config("filewriter", "nimages_per_file", self._nimages_per_file, group="filewriter")
+        self.queue_config("detector", "compression", self.CompressionAlgorithm.value)
     
     def set_monitor_and_stream_config(self):
         self.client.monitorConfig("mode","disabled")
@@ -153,22 +242,31 @@ class DEigerIOC(PVGroup):
         self.client.setStreamConfig("mode","disabled")
         # self.client.setStreamConfig("header_detail", "all")
 
-    def configure_detector(self):     
-        """ runs all the required detector initializations before a measurement"""   
-
-        if not self._detector_initialized:
-            print('before configuring the detector, I will intialize it at least once...')
-            self.initialize_detector()
+    async def configure_detector(self):     
+        """ runs all the required detector initializations before a measurement. 
+        The detector should be initialized first, see the Configure putter"""   
         self.set_energy_values()
         self.set_timing_values()
-        self.empty_data_store()
+        # the data store has to be emptied before the new filewriter settings are written
+        await self.run_blocking(self.empty_data_store)
         self.set_filewriter_config()
-        self.client.setDetectorConfig("countrate_correction_applied", self.CountRateCorrection.value)
-        self.client.setDetectorConfig("flatfield_correction_applied", self.FlatFieldCorrection.value)
-        self.client.setDetectorConfig("pixel_mask_applied", self.PixelMaskCorrection.value)        
-
-    def read_detector_configuration_safely(self, key:str="", default=None, readMethod: str = 'detectorStatus'):
-        """ reads the detector configuration of a particular key and returns it as a dictionary. Safely handles errors"""
+        self.queue_config("detector", "countrate_correction_applied", self.CountRateCorrection.value)
+        self.queue_config("detector", "flatfield_correction_applied", self.FlatFieldCorrection.value)
+        self.queue_config("detector", "pixel_mask_applied", self.PixelMaskCorrection.value)        
+        await self.flush_config()
+        # the detector configuration just changed, cached reads are stale
+        self._read_cache.clear()
+
+    def read_detector_configuration_safely(self, key:str="", default=None, readMethod: str = 'detectorStatus', max_age: float | None = None):
+        """ reads the detector configuration of a particular key and returns it as a dictionary. Safely handles errors.
+        Successful reads are cached, a cached value younger than max_age seconds (default _read_cache_ttl) is returned 
+        without an HTTP request. max_age=0 always reads from the detector"""
+        if max_age is None:
+            max_age = self._read_cache_ttl
+        now = time.monotonic()
+        cached = self._read_cache.get((readMethod, key))
+        if cached is not None and now - cached[0] < max_age:
+            return cached[1]
         try:
             if readMethod == 'detectorStatus':
                 answer = self.client.detectorStatus(key)
@@ -178,131 +276,213 @@ class DEigerIOC(PVGroup):
             if not isinstance(answer, dict):
                 return default
             else:
+                self._read_cache[(readMethod, key)] = (now, answer["value"])
+                self._consecutive_read_failures = 0
                 return answer["value"]
-        except:
+        except (RequestException, RuntimeError, KeyError, ValueError, TypeError) as e:
+            # RuntimeError is what DEigerClient raises on a non-2xx reply, ValueError covers undecodable JSON
+            self._consecutive_read_failures += 1
+            # warn once when the detector stops answering, not on every poll after that
+            log = logger.warning if self._consecutive_read_failures == 1 else logger.debug
+            log("could not read %s %s: %r", readMethod, key, e)
             return default
 
-    def read_and_dump_files(self):
-        """ reads all files in the data store and dumps them to disk at the location specified upon IOC init"""
-
-        expected_number_of_files = np.ceil(self._nframes/self._nimages_per_file)+1
+    async def read_config_value(self, key: str) -> float:
+        """ reads a numeric detector config value for the readback getters. A cached value is returned straight away, 
+        without waiting for the communications lock or an executor thread. On a miss only the first caller reads 
+        from the detector, callers for the same key wait for it and get its (now cached) value"""
+        cached = self._read_cache.get(('detectorConfig', key))
+        if cached is not None and time.monotonic() - cached[0] < self._config_cache_ttl:
+            return float(cached[1])
+        # read_detector_configuration_safely checks the cache again, after waiting for the key's lock
+        async with self._config_read_locks[key], self._communications_lock.reader:
+            return float(await self.run_blocking(self.read_detector_configuration_safely, key, -999.0, 'detectorConfig', 
+                                                 self._config_cache_ttl))
+
+    def read_detector_status(self, keys: dict) -> dict:
+        """ reads several detector status keys in one go, returns a {key: value} dictionary. 
+        keys maps each status key to the default returned when it cannot be read"""
+        return {key: self.read_detector_configuration_safely(key, default, readMethod='detectorStatus') for key, default in keys.items()}
+
+    async def read_and_dump_files(self):
+        """ reads all files in the data store and dumps them to disk at the location specified upon IOC init. 
+        The files are downloaded concurrently on the IOC executor"""
+        expected_number_of_files = -(-self._nframes // self._nimages_per_file) + 1 # data files (ceil) plus the master file
         
-        filenames = self.client.fileWriterFiles()# returns all files in datastore
-        ntry = 250 # 25 seconds...
+        # the files should appear shortly after the exposure ends: poll quickly at first, backing off to 1 s, 
+        # for up to 25 s after the (expected) end of the exposure. _starttime_monotonic is only kept when the trigger 
+        # succeeded, otherwise there is no exposure to wait for and this gives up 25 s from now
+        now = time.monotonic()
+        exposure_end = now if self._starttime_monotonic is None else max(now, self._starttime_monotonic + self._count_time)
+        deadline = exposure_end + 25
+        delay = .1
+        filenames = await self.run_blocking(self.client.fileWriterFiles)# returns all files in datastore
         while not len(filenames)>=expected_number_of_files:
-            time.sleep(.1)
-            filenames = self.client.fileWriterFiles() #['value'] # returns all files in datastore
-            if ntry <0:
-                print('did not find the needed number of files after 20 seconds')
+            if time.monotonic() > deadline:
+                logger.warning('did not find the needed number of files within 25 seconds after the exposure')
                 return 
-            ntry -= 1
-
-        print(f'filenames found: {filenames}')
-        for filename in filenames:
-            if (filename in os.listdir(self.LocalFileDumpPath)) or not filename.startswith(self.OutputFilePrefix.value):
-                continue # skip if file already exists or is one we're not looking for
-            print(f'retrieving: {filename}')
-            self.client.fileWriterSave(filename, self.LocalFileDumpPath)
-            asyncio.run(self.LatestFile.write(str(filename)))
-            if 'master' in filename:
-                asyncio.run(self.LatestFileMain.write(str(filename)))
-            elif 'data' in filename:
-                asyncio.run(self.LatestFileData.write(str(filename)))
-
-    def retrieve_all_and_clear_files(self):
-        """ retrieves all files from the data store and clears the data store"""
-        self.read_and_dump_files()
-        self.empty_data_store()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            filenames = await self.run_blocking(self.client.fileWriterFiles) #['value'] # returns all files in datastore
+
+        logger.debug('filenames found: %s', filenames)
+        # skip files that already exist or are ones we're not looking for
+        prefix = self._output_prefix
+        with os.scandir(self.LocalFileDumpPath) as entries:
+            existing = {entry.name for entry in entries if entry.name.startswith(prefix)}
+        new_files = [filename for filename in filenames if filename not in existing and filename.startswith(prefix)]
+        logger.debug('retrieving: %s', new_files)
+        await asyncio.gather(*[self.dump_file(filename) for filename in new_files])
+
+    async def dump_file(self, filename: str):
+        """ downloads a single file from the data store and announces it in LatestFile as soon as it is on disk. 
+        The file is then deleted from the data store right away, freeing detector memory while the other downloads 
+        are still running. Concurrent downloads are bounded by the IOC executor's worker count"""
+        await self.run_blocking(self.client.fileWriterSave, filename, self.LocalFileDumpPath)
+        delete = asyncio.create_task(self.run_blocking(self.client.fileWriterFiles, filename, 'DELETE'))
+        await self.LatestFile.write(str(filename))
+        # classify on the filewriter's own suffixes, so an output prefix containing 'data' or 'master' can't confuse it
+        if filename.endswith('_master.h5'):
+            await self.LatestFileMain.write(str(filename))
+        elif '_data_' in filename:
+            await self.LatestFileData.write(str(filename))
+        try:
+            await delete
+        except (RequestException, RuntimeError) as e:
+            # not fatal, the data store is cleared after the retrieval anyway
+            logger.debug("could not delete %s from the data store: %r", filename, e)
+
+    async def retrieve_all_and_clear_files(self):
+        """ retrieves all files from the data store and clears the data store (also of files that were not retrieved),
+        re-enabling the filewriter for the next exposure"""
+        await self.read_and_dump_files()
+        await self.run_blocking(self.empty_data_store)
 
     async def wait_for_init_complete(self):
+        # the periodic status read can be up to 30 s old while the detector is idle, refresh it before deciding
+        await self.update_detector_status()
         reconfigure = False
         if self.DetectorState.value in ['error']:
-            print('error state detected in detector, restarting before reinitializing...')
+            logger.warning('error state detected in detector, restarting before reinitializing...')
             await self.Restart.write(True)
             await asyncio.sleep(2)
             reconfigure = True
 
         if self.DetectorState.value in ['na', 'error', 'ready']:
-            print('error state detected in detector, reinitializing before triggering...')
+            logger.warning('error state detected in detector, reinitializing before triggering...')
             await self.Initialize.write(True)
             await asyncio.sleep(.1)
             reconfigure = True
             
-        counter = 0
-        while self.Initialize_RBV.value not in ['Off', False]:
-            counter += 1
-            await asyncio.sleep(.1)
-            if (counter % 10 == 0):
-                print('waiting for initialization to complete...')
-            if counter>250:
-                break
+        try:
+            await asyncio.wait_for(self._init_done.wait(), timeout=25)
+        except asyncio.TimeoutError:
+            logger.warning('initialization did not complete within 25 seconds, continuing anyway')
 
         if reconfigure: 
             await self.Configure.write(True)
             await asyncio.sleep(.1)
             reconfigure = False
 
-        counter = 0
-        while self.Configure_RBV.value not in ['Off', False]:
-            counter += 1
-            await asyncio.sleep(.1)
-            if (counter % 10 == 0):
-                print('waiting for configuration to complete...')
-            if counter>250:
-                break
+        try:
+            await asyncio.wait_for(self._configure_done.wait(), timeout=25)
+        except asyncio.TimeoutError:
+            logger.warning('configuration did not complete within 25 seconds, continuing anyway')
+
+    async def send_detector_command(self, command: str, succeeded: Callable[[dict], bool], exclusive: bool = True, 
+                                    attempts: int = 20) -> bool:
+        """ sends a detector command until succeeded(answer) holds, for at most `attempts` tries. The first attempt goes 
+        out immediately, retries back off from 0.1 s up to 2 s. exclusive=False sends the command without taking the 
+        communications lock. Returns whether the command succeeded"""
+        backoff = .1
+        for attempt in range(1, attempts + 1):
+            try:
+                async with self._communications_lock.writer if exclusive else contextlib.nullcontext():
+                    answer = await self.run_blocking(self.client.sendDetectorCommand, command)
+                logger.debug('%s answer = %r', command, answer)
+                if isinstance(answer, dict) and succeeded(answer):
+                    return True # correct response, done if we got to this stage
+            except (RequestException, RuntimeError) as e:
+                logger.warning('trouble sending %s to the detector in attempt %d (%s), trying again in %s s', command, 
+                               attempt, e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 2.)
+        return False
 
     async def arm_trigger_disarm(self):
-        print('arming detector')
-        counter = 0  
-        loop = asyncio.get_event_loop()
-        # await loop.run_in_executor(None, self.initialize_detector)
-        while counter <20: # can take up to 20 seconds
-            counter += 1
-            try:
-                await asyncio.sleep(.1)
-                async with self._communications_lock:
-                    arm_answer = await loop.run_in_executor(None, self.client.sendDetectorCommand, "arm")
-                print(f'{arm_answer =}')
-                if isinstance(arm_answer, dict):
-                    if arm_answer.get('sequence id', -1) >= 0:
-                        break # correct response, done if we got to this stage
-            except RuntimeError:
-                print(f'trouble arming detector in attempt {counter}, waiting a second before trying again')
-                await asyncio.sleep(1)
-
-        print('triggering detector')
-        counter = 0
-        self._starttime = datetime.now(timezone.utc)
-        while counter <20:
-            counter += 1
-            try:
-                # do not lock this or we'll be stuck for the duration of the exposure
-                # async with self._communications_lock:
-                await asyncio.sleep(.5)
-                trigger_answer = await loop.run_in_executor(None, self.client.sendDetectorCommand, "trigger")
-                print(f'{trigger_answer =}')
-                if isinstance(trigger_answer, dict):
-                    if trigger_answer.get('sequence id', 0) == -1:
-                        break # correct response, done if we got to this stage
-            except RuntimeError:
-                print(f'trouble triggering detector in attempt {counter}, waiting a second before trying again')
-                await asyncio.sleep(1)
-        print('disarming detector')
-        counter = 0
-        while counter <20:
-            counter += 1
-            try:
-                await asyncio.sleep(.1)
-                async with self._communications_lock:
-                    disarm_answer = await loop.run_in_executor(None, self.client.sendDetectorCommand, "disarm")
-                print(f'{disarm_answer =}')
-                if isinstance(disarm_answer, dict):
-                    if disarm_answer.get('sequence id', -1) >= 0:
-                        break # correct response, done if we got to this stage
-            except RuntimeError:
-                print(f'trouble disarming detector in attempt {counter}, waiting a second before trying again')
-                await asyncio.sleep(1)
+        logger.info('arming detector')
+        if await self.send_detector_command("arm", lambda answer: answer.get('sequence id', -1) >= 0):
+            self._status_wakeup.set()
 
+        triggered = False
+        try:
+            logger.info('triggering detector')
+            self._starttime_monotonic = time.monotonic()
+            # do not lock this or we'll be stuck for the duration of the exposure
+            triggered = await self.send_detector_command("trigger", lambda answer: answer.get('sequence id', 0) == -1, 
+                                                         exclusive=False)
+        finally:
+            if not triggered:
+                # no exposure took place: stop the countdown, and don't make the file retrieval wait for one
+                self._starttime_monotonic = None
+            # always disarm, also when the exposure is cancelled or fails, so the detector is not left armed
+            await asyncio.shield(self.disarm_detector())
+
+    async def disarm_detector(self):
+        logger.info('disarming detector')
+        if await self.send_detector_command("disarm", lambda answer: answer.get('sequence id', -1) >= 0):
+            self._status_wakeup.set()
+
+    async def finish_trigger(self):
+        """ retrieves and clears the files of the last exposure and releases Trigger_RBV """
+        logger.info('retrieving files')
+        try:
+            async with self._communications_lock.writer:
+                await self.retrieve_all_and_clear_files()
+            logger.info('done retrieving files')
+        finally:
+            self._capture_in_progress = False
+            await self.Trigger_RBV.write(False)
+
+    async def update_detector_status(self, read_temperature: bool = False):
+        """ reads the detector state and time (and optionally the temperature) in one executor call and updates the PVs"""
+        keys = {"state": "unknown", "time": "unknown"}
+        if read_temperature:
+            keys["board_000/th0_temp"] = -999.0
+        async with self._communications_lock.reader:
+            status = await self.run_blocking(self.read_detector_status, keys)
+        await self.DetectorState.write(status["state"])
+        await self.DetectorTime.write(status["time"])
+        if "board_000/th0_temp" in status:
+            await self.DetectorTemperature.write(float(status["board_000/th0_temp"]))
+
+    @staticmethod
+    def _log_status_task_error(task: asyncio.Task):
+        """ the status read task is never awaited, report its errors here instead of losing them """
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("periodic detector status update failed", exc_info=task.exception())
+
+    def status_period(self) -> float:
+        """ seconds until the next detector status read: fast while the detector is in trouble, slow while it is idle
+        or measuring (the IOC wakes the status read itself when it arms or disarms), 5 s in transitional states.
+        Slow as well while the detector does not answer at all"""
+        if self._consecutive_read_failures > 5:
+            return 30 # detector unreachable, don't hammer it
+        state = self.DetectorState.value
+        if state in ['error', 'na']:
+            return 1
+        if state in ['idle', 'ready', 'acquire']:
+            return 30
+        return 5
+
+    async def update_seconds_remaining(self):
+        if self._starttime_monotonic is not None:
+            remaining = max(int(self._count_time - (time.monotonic() - self._starttime_monotonic)), 0)
+        else:
+            remaining = -999
+        # only post a monitor update when the countdown actually changed (e.g. not every second while idle)
+        if remaining != self.SecondsRemaining.value:
+            await self.SecondsRemaining.write(remaining)
 
     # Detector state readouts
     DetectorState = pvproperty(value = '', doc="State of the detector, can be 'busy' or 'idle'", dtype=str, record='stringin',
@@ -320,6 +500,8 @@ class DEigerIOC(PVGroup):
     CountRateCorrection = pvproperty(value = True, doc="do you want count rate correction applied by the detector (using int maths)", record='bi')
     FlatFieldCorrection = pvproperty(value = False, doc="do you want flat field correction applied by the detector (using int maths)", record='bi')
     PixelMaskCorrection = pvproperty(value = False, doc="do you want pixel mask correction applied by the detector", record='bi')
+    CompressionAlgorithm = pvproperty(value = "bslz4", doc="HDF5 compression applied by the detector: 'bslz4' (bitshuffle+lz4) or 'lz4'", 
+                                      dtype=ChannelType.ENUM, enum_strings=["bslz4", "lz4"], record='mbbi')
 
     # operating the detector
     Restart = pvproperty(doc="Restart the detector, resets to False immediately", dtype=bool, record='bi')
@@ -336,95 +518,130 @@ class DEigerIOC(PVGroup):
     LatestFileMain = pvproperty(value = '', doc="Shows the name of the latest output main file retrieved", dtype=str, record='stringin', report_as_string=True)
     SecondsRemaining = pvproperty(value = 0.0, doc="Shows the seconds remaining for the current exposure", dtype=float, record='ai')
 
-    @DetectorState.scan(period=5, use_scan_field=True, subtract_elapsed=True)
+    @DetectorState.startup
     async def DetectorState(self, instance, async_lib):
-        async with self._communications_lock:
-            await self.DetectorState.write(self.read_detector_configuration_safely("state", "unknown", readMethod='detectorStatus'))
-
-    @DetectorTemperature.scan(period=60, use_scan_field=True, subtract_elapsed=True)
-    async def DetectorTemperature(self, instance, async_lib):
-        async with self._communications_lock:
-            await self.DetectorTemperature.write(float(self.read_detector_configuration_safely("board_000/th0_temp", -999.0, readMethod='detectorStatus')))
-
-    @SecondsRemaining.scan(period=1, use_scan_field=True, subtract_elapsed=True)
-    async def SecondsRemaining(self, instance, async_lib):
-        if self._starttime is not None:
-            elapsed = datetime.now(timezone.utc) - self._starttime
-            remaining = self.CountTime.value - elapsed.total_seconds()
-            await self.SecondsRemaining.write(int(np.maximum(remaining, 0)))
-        else:
-            await self.SecondsRemaining.write(-999)
-
-    @DetectorTime.getter
-    async def DetectorTime(self, instance):
-        async with self._communications_lock:
-            await self.DetectorTime.write(self.read_detector_configuration_safely("time", "unknown", readMethod='detectorStatus'))
+        """ single 1 s heartbeat for all periodic PV updates, instead of one caproto scan timer per PV:
+        SecondsRemaining every tick, DetectorState and DetectorTime at a state-dependent period (see status_period)
+        and DetectorTemperature once a minute. Arming and disarming wake the status read up on the next tick. 
+        The status read runs as a separate task so a held communications lock never stalls the countdown"""
+        status_task = None
+        next_status = next_temperature = time.monotonic()
+        while True:
+            t0 = time.monotonic()
+            # a failing tick is logged and the heartbeat carries on, otherwise all periodic updates would stop
+            try:
+                await self.update_seconds_remaining()
+                # no periodic status reads while a capture is running, they would only queue up behind 
+                # the capture's detector commands. A wakeup set by the disarm fires as soon as the capture is done
+                due = self._status_wakeup.is_set() or t0 >= next_status
+                if due and not self._capture_in_progress and (status_task is None or status_task.done()):
+                    self._status_wakeup.clear()
+                    read_temperature = t0 >= next_temperature
+                    if read_temperature:
+                        next_temperature = t0 + 60
+                    status_task = asyncio.create_task(self.update_detector_status(read_temperature=read_temperature))
+                    status_task.add_done_callback(self._log_status_task_error)
+                    next_status = t0 + self.status_period()
+            except Exception:
+                logger.exception("error in the periodic PV update")
+            await asyncio.sleep(max(0, 1 - (time.monotonic() - t0)))
+
+    @DetectorState.shutdown
+    async def DetectorState(self, instance, async_lib):
+        # release the worker threads and the pooled detector connections when the IOC stops
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
 
     @CountTime_RBV.getter
     async def CountTime_RBV(self, instance):
-        async with self._communications_lock:
-            await self.CountTime_RBV.write(float(self.read_detector_configuration_safely("count_time", -999.0, readMethod='detectorConfig')))
+        await self.CountTime_RBV.write(await self.read_config_value("count_time"))
 
     @CountTime.getter
     async def CountTime(self, instance):
-        async with self._communications_lock:
-            await self.CountTime_RBV.write(float(self.read_detector_configuration_safely("count_time", -999.0, readMethod='detectorConfig')))
+        await self.CountTime_RBV.write(await self.read_config_value("count_time"))
 
     @FrameTime_RBV.getter
     async def FrameTime_RBV(self, instance):
-        async with self._communications_lock:
-            await self.FrameTime_RBV.write(float(self.read_detector_configuration_safely("frame_time", -999.0, readMethod='detectorConfig')))
+        await self.FrameTime_RBV.write(await self.read_config_value("frame_time"))
 
     @FrameTime.getter
     async def FrameTime(self, instance):
-        async with self._communications_lock:
-            await self.FrameTime_RBV.write(float(self.read_detector_configuration_safely("frame_time", -999.0, readMethod='detectorConfig')))
+        await self.FrameTime_RBV.write(await self.read_config_value("frame_time"))
+
+    @FrameTime.putter
+    async def FrameTime(self, instance, value: float):
+        self._frame_time = value
+
+    @CountTime.putter
+    async def CountTime(self, instance, value: float):
+        self._count_time = value
+
+    @OutputFilePrefix.putter
+    async def OutputFilePrefix(self, instance, value: str):
+        self._output_prefix = value
 
+    @CompressionAlgorithm.putter
+    async def CompressionAlgorithm(self, instance, value: str):
+        # caproto maps enum indices to strings but lets any string through, only accept what the detector supports
+        if value not in instance.enum_strings:
+            raise ValueError(f"unsupported compression {value!r}, choose one of {instance.enum_strings}")
+        return value
 
     @Initialize.putter
     async def Initialize(self, instance, value: bool):
         # await self.ReadyToTrigger.write(False)
         if value:
-            await self.Initialize_RBV.write(True)
-            loop = asyncio.get_event_loop()
-            print('Initializer running self.initialize_detector')
-            async with self._communications_lock:
-                await loop.run_in_executor(None, self.initialize_detector)
-            await self.Initialize_RBV.write(False)
+            self._init_done.clear()
+            try:
+                await self.Initialize_RBV.write(True)
+                logger.debug('Initializer running self.initialize_detector')
+                await self.initialize_detector()
+            finally:
+                await self.Initialize_RBV.write(False)
+                self._init_done.set()
+                self._status_wakeup.set()
 
     @Configure.putter
     async def Configure(self, instance, value: bool):
         if value:
-            await self.Configure_RBV.write(True)
-            loop = asyncio.get_event_loop()
-            async with self._communications_lock:
-                await loop.run_in_executor(None, self.configure_detector)
-            await self.Configure_RBV.write(False)
+            self._configure_done.clear()
+            try:
+                await self.Configure_RBV.write(True)
+                if not self._detector_initialized:
+                    logger.info('before configuring the detector, I will intialize it at least once...')
+                    await self.initialize_detector()
+                async with self._communications_lock.writer:
+                    await self.configure_detector()
+            finally:
+                await self.Configure_RBV.write(False)
+                self._configure_done.set()
+                self._status_wakeup.set()
 
     @Restart.putter
     async def Restart(self, instance, value: bool):
         if value:
             await self.Restart_RBV.write(True)
-            loop = asyncio.get_event_loop()
-            async with self._communications_lock:
-                await loop.run_in_executor(None, self.restart_detector)
+            async with self._communications_lock.writer:
+                await self.run_blocking(self.restart_detector)
             await self.Restart_RBV.write(False)
+            self._status_wakeup.set()
 
     @Trigger.putter
     async def Trigger(self, instance, value: bool):
         if value:
-            await self.Trigger_RBV.write(True)
-            # ensure initialisation is complete first..
-            print('running wait_for_init_complete()')
-            await self.wait_for_init_complete()
-            loop = asyncio.get_event_loop()
-            # this one has locks in it
-            await self.arm_trigger_disarm()
-            print('retrieving files')
-            async with self._communications_lock:
-                await loop.run_in_executor(None, self.retrieve_all_and_clear_files)
-            print('done retrieving files')
-            await self.Trigger_RBV.write(False)
+            try:
+                # cleared by finish_trigger in the finally below, also when writing Trigger_RBV fails
+                self._capture_in_progress = True
+                await self.Trigger_RBV.write(True)
+                # ensure initialisation is complete first..
+                logger.debug('running wait_for_init_complete()')
+                await self.wait_for_init_complete()
+                # this one has locks in it
+                await self.arm_trigger_disarm()
+            finally:
+                # retrieve and clear whatever was measured, also after a cancelled exposure, so the data store 
+                # doesn't fill up. Shielded so that a cancellation during cleanup doesn't abort it halfway.
+                await asyncio.shield(self.finish_trigger())
             
 def main(args=None):
     parser, split_args = template_arg_parser(
@@ -442,7 +659,9 @@ def main(args=None):
 
     args = parser.parse_args()
 
-    logging.info(f"Running Dectis Eiger IOC on {args}")
+    # the IOC reports its progress (arming, triggering, file retrieval) through the DEigerIOC logger
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger.info("Running Dectis Eiger IOC on %s", args)
 
     ioc_options, run_options = split_args(args)
 
@@ -0,0 +1,168 @@
+"""
+class PooledDEigerClient routes the DEigerClient REST traffic through a pooled, keep-alive requests.Session
+
+The stock DEigerClient talks over a single http.client connection, which is not safe to share
+between the worker threads the IOC dispatches detector calls to, and opens a fresh urllib
+connection for every file download. Here all requests (including file downloads) go through
+one requests.Session, so consecutive calls reuse the same TCP connection and concurrent calls
+each get a connection from the pool.
+If orjson is installed, it is used to (de)serialize the JSON request and reply bodies.
+"""
+
+import json
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from deigerclient import DEigerClient
+
+try:
+    import orjson
+except ImportError: # optional, the stdlib json module is used without it
+    orjson = None
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pooled connections have TCP keepalive enabled, so an idle connection to the detector 
+    (e.g. between slow status polls) is kept open, and a dead one is noticed, without any HTTP traffic.
+    """
+
+    # seconds of idleness before the first keepalive probe, and between probes
+    keepaliveIdle = 30
+    keepaliveInterval = 10
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        # the fine-grained keepalive timings are not available on every platform
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepaliveIdle))
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keepaliveInterval))
+        kwargs['socket_options'] = options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledDEigerClient(DEigerClient):
+    """
+    DEigerClient with a pooled requests.Session transport. Drop-in replacement for DEigerClient.
+    """
+
+    # size of the reusable buffer that downloaded files are streamed through
+    downloadChunkSize = 1024*1024
+
+    def __init__(self, host='127.0.0.1', port=80, verbose=False, urlPrefix=None, user=None, poolMaxsize=8):
+        """
+        Args:
+            host: hostname of the detector computer
+            port: port usually 80 (http)
+            verbose: bool value
+            urlPrefix: String prepended to the urls. Should be None.
+            user: "username:password". Should be None.
+            poolMaxsize: maximum number of keep-alive connections kept open to the detector
+        """
+        super().__init__(host, port=port, verbose=verbose, urlPrefix=urlPrefix, user=user)
+        # IPv6 literals need brackets in a URL
+        self._baseUrl = 'http://{0}:{1}'.format('[{0}]'.format(host) if ':' in host else host, port)
+        self._session = requests.Session()
+        self._session.headers.update({'Connection': 'keep-alive'})
+        # connection failures are retried for every request: the request never reached the detector then, so this 
+        # is safe for non-idempotent commands (arm, trigger, ...) as well. Transient server errors are only retried
+        # for reads (GET); once those retries are used up the error reply is returned and raised as usual.
+        retries = Retry(total=5, connect=5, read=0, status=3, other=0, backoff_factor=0.2,
+                        status_forcelist=[500, 502, 503, 504], allowed_methods=frozenset(['GET']), raise_on_status=False)
+        self._session.mount(self._baseUrl, KeepAliveHTTPAdapter(pool_connections=1, pool_maxsize=poolMaxsize, max_retries=retries))
+        if orjson is not None:
+            self.setSerializer(orjson)
+        # one download buffer per worker thread, allocated once and reused for every file
+        self._downloadBuffers = threading.local()
+
+    def close(self):
+        """ closes all pooled connections to the detector """
+        self._session.close()
+
+    def fileWriterSave(self, filename, targetDir, regex=False):
+        """
+        Saves filename in targetDir, streaming the file over the pooled session.
+        Wildcards and regular expressions are handled as in DEigerClient.fileWriterSave.
+        """
+        if regex or any([c in filename for c in ['*', '?', '[', ']']]):
+            return super().fileWriterSave(filename, targetDir, regex=regex)
+        targetPath = os.path.join(targetDir, filename)
+        url = '{0}/{1}data/{2}'.format(self._baseUrl, self._urlPrefix, filename)
+        # the raw stream is copied to disk undecoded, so ask for the file as-is (it is bslz4-compressed already)
+        with self._session.get(url, headers={'Accept-Encoding': 'identity'}, stream=True, timeout=self._connectionTimeout) as response:
+            if not response.status_code in range(200, 300):
+                raise RuntimeError((response.reason, filename))
+            with open(targetPath, 'wb') as fp:
+                self._log('Writing ', targetPath)
+                self._copyToFile(response.raw, fp)
+                self._dropFromPageCache(fp)
+        assert os.access(targetPath, os.R_OK)
+        return
+
+    def _copyToFile(self, source, fp):
+        """ streams source into fp through this thread's reusable buffer, without holding the file in memory """
+        buffer = getattr(self._downloadBuffers, 'buffer', None)
+        if buffer is None:
+            buffer = self._downloadBuffers.buffer = memoryview(bytearray(self.downloadChunkSize))
+        while True:
+            n = source.readinto(buffer)
+            if not n:
+                break
+            fp.write(buffer[:n])
+
+    def _dropFromPageCache(self, fp):
+        """ 
+        the downloaded file is for downstream consumers and is not read again here, so flush it to disk
+        and tell the kernel to drop its pages, freeing the page cache for the next (multi-GB) file. Linux only.
+        """
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        fp.flush()
+        os.fsync(fp.fileno())
+        try:
+            os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+    def _request(self, url, method, mimeType, data=None, fileId=None):
+        headers = {}
+        if method == 'GET':
+            headers['Accept'] = mimeType
+        elif method == 'PUT':
+            headers['Content-type'] = mimeType
+        if not self._user is None:
+            headers["Authorization"] = "Basic {0}".format(self._user)
+
+        self._log('sending request to {0}'.format(url))
+        try:
+            response = self._session.request(method, self._baseUrl + url, data=data, headers=headers,
+                                             timeout=self._connectionTimeout, stream=fileId is not None)
+        except requests.ConnectionError:
+            self._log("Failed to connect to host after retrying\n")
+            raise
+
+        if fileId is None:
+            data = response.content
+        else:
+            data = b''
+            for chunk in response.iter_content(8*1024):
+                fileId.write(chunk)
+
+        mimeType = response.headers.get('content-type', 'text/plain')
+        self._log('Return status: ', response.status_code, response.reason)
+        if not response.status_code in range(200, 300):
+            raise RuntimeError((response.reason, data))
+        if 'json' in mimeType:
+            if self._serializer is None:
+                return json.loads(data)
+            else:
+                return self._serializer.loads(data)
+        else:
+            return data
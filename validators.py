@@ -1,13 +1,17 @@
 import socket
-from pathlib import Path
 import os
+import stat
 
 # Validators for IP and Port
 def validate_ip_address(instance, attribute, value):
+    # inet_pton is strict (no shortened IPv4 forms like '10.1') and also accepts IPv6 addresses
     try:
-        socket.inet_aton(value)
-    except socket.error:
-        raise ValueError(f"Invalid IP address: {value}")
+        socket.inet_pton(socket.AF_INET, value)
+    except OSError:
+        try:
+            socket.inet_pton(socket.AF_INET6, value)
+        except OSError:
+            raise ValueError(f"Invalid IP address: {value}")
 
 
 def validate_port_number(instance, attribute, value):
@@ -15,11 +19,10 @@ def validate_port_number(instance, attribute, value):
         raise ValueError(f"Port number must be between 0 and 65535, got {value}")
 
 def ensure_directory_exists_and_is_writeable(instance, attribute, value):
-    path = Path(value)
-    path.mkdir(parents=True, exist_ok=True)  # Create the directory if it doesn't exist
+    path = os.fspath(value)
+    os.makedirs(path, exist_ok=True)  # Create the directory if it doesn't exist
 
-    if not path.is_dir():
+    if not stat.S_ISDIR(os.stat(path).st_mode):
         raise ValueError(f"The directory '{value}' does not exist.")
     if not os.access(path, os.W_OK):
         raise ValueError(f"The directory '{value}' is not writable.")
-    
\ No newline at end of file